@@ -2,17 +2,31 @@ import streamlit as st
 import base64
 import json
 import os
+import sys
+import argparse
 import datetime
 import requests
 from bs4 import BeautifulSoup
 from collections import namedtuple
+from collections.abc import Mapping
+from array import array
 import io
 from PIL import Image
 import re
+import unicodedata
+import math
 import configparser
 import tenacity
 import tiktoken
-from typing import Tuple
+import threading
+import time
+import random
+import functools
+import heapq
+import itertools
+import email.utils
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional, Tuple
 from groq import Groq
 
 # Configuração da página
@@ -20,12 +34,51 @@ st.set_page_config(layout="wide")
 
 # Definição de variáveis globais e classes
 FILEPATH = "agents.json"
+NEW_EXPERT_OPTION = 'Escolher um especialista...'
+AGENTS_FILE_LOCK = threading.Lock()
+EXPERT_SIMILARITY_THRESHOLD = 0.35
+# Sem acentos, como os tokens gerados por tokenize_expert_text. Inclui palavras
+# interrogativas e de modelo de pergunta, que não dizem nada sobre o assunto.
+EXPERT_STOPWORDS = {
+    "que", "para", "com", "uma", "uns", "umas", "por", "como", "mais", "menos", "dos", "das", "nos", "nas",
+    "sua", "seu", "suas", "seus", "sobre", "entre", "ser", "sao", "aos", "esta", "este", "isso", "essa", "esse",
+    "qual", "quais", "quem", "onde", "quando", "porque", "quanto", "quantos", "existe", "existem",
+    "funciona", "funcionam", "efeito", "efeitos", "impacto", "impactos", "importancia", "diferenca", "diferencas",
+    "melhor", "melhores", "principais", "explique", "explicar", "descreva", "fale", "diga", "quero", "gostaria",
+    "saber", "preciso", "ajude", "pode", "podem", "deve", "devo", "fazer", "seria", "brasil", "brasileira",
+    "brasileiro", "brasileiras", "brasileiros", "the", "and", "for", "with", "you", "voce", "what", "how", "why",
+    "which", "does", "are", "this", "that", "from", "about",
+}
 MODEL_MAX_TOKENS = {
     'mixtral-8x7b-32768': 32768,
     'llama3-70b-8192': 8192,
     'llama3-8b-8192': 8192,
     'gemma-7b-it': 8192,
 }
+RESPONSE_MODES = {
+    "Modelo único": "single",
+    "Corrida entre modelos": "race",
+    "Lado a lado": "side_by_side",
+}
+BATCH_DEFAULT_CONCURRENCY = 8
+BATCH_MAX_REQUEUES = 5
+BATCH_REQUEUE_MAX_DELAY = 120.0
+LATENCY_EWMA_ALPHA = 0.3
+LATENCY_FAILURE_PENALTY = 60.0
+LATENCY_LOSER_MARGIN = 1.5
+ARXIV_HOST = "arxiv.org"
+OPENAI_HOST = "api.openai.com"
+GROQ_HOST = "api.groq.com"
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 10.0
+RETRY_AFTER_MAX_DELAY = 60.0
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MAX_TOKENS = 10.0
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+ARXIV_REQUEST_TIMEOUT = (10, 60)
 
 # Verificação e criação do diretório necessário
 STATIC_DIRECTORY = 'static'
@@ -34,21 +87,285 @@ if not os.path.exists(STATIC_DIRECTORY):
 
 import fitz  # PyMuPDF
 
+# Resiliência das chamadas de rede
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    # Fechado -> aberto após falhas seguidas do host (conexão, timeout, 5xx);
+    # depois de BREAKER_RESET_TIMEOUT deixa passar uma única chamada de teste
+    # (meio-aberto). Respostas 429 não contam como falha.
+    def __init__(self, host):
+        self.host = host
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.probing or time.monotonic() - self.opened_at < BREAKER_RESET_TIMEOUT:
+                raise CircuitOpenError(f"Circuito aberto para {self.host}; tente novamente mais tarde.")
+            self.probing = True
+
+    def retry_in(self):
+        # Segundos até o disjuntor voltar a aceitar chamadas (0 se fechado).
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            if self.probing:
+                return 1.0
+            return max(0.0, BREAKER_RESET_TIMEOUT - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= BREAKER_FAILURE_THRESHOLD:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+class RetryBudget:
+    # Cada chamada deposita RETRY_BUDGET_RATIO fichas e cada nova tentativa
+    # gasta uma, limitando as novas tentativas a uma fração do tráfego.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = RETRY_BUDGET_MAX_TOKENS
+
+    def record_call(self):
+        with self.lock:
+            self.tokens = min(RETRY_BUDGET_MAX_TOKENS, self.tokens + RETRY_BUDGET_RATIO)
+
+    def try_spend(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class ResilienceState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.breakers = {}
+        self.budget = RetryBudget()
+
+    def breaker(self, host):
+        with self.lock:
+            return self.breakers.setdefault(host, CircuitBreaker(host))
+
+@st.cache_resource
+def get_resilience_state():
+    return ResilienceState()
+
+def error_status_code(error):
+    for attr in ('status_code', 'http_status'):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    return getattr(getattr(error, 'response', None), 'status_code', None)
+
+def is_retryable_error(error):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+        return True
+    status = error_status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return any(kind in type(error).__name__ for kind in ("Timeout", "Connection", "ServiceUnavailable", "APIError"))
+
+def retry_after_seconds(error):
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.datetime.now(retry_at.tzinfo)).total_seconds())
+    except (TypeError, ValueError, AttributeError):
+        # Cabeçalho malformado: segue o backoff normal.
+        return None
+
+def wait_retry_after_or_jitter(retry_state):
+    retry_after = retry_after_seconds(retry_state.outcome.exception())
+    if retry_after is not None:
+        return min(retry_after, RETRY_AFTER_MAX_DELAY)
+    # Backoff exponencial com "full jitter".
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (retry_state.attempt_number - 1)))
+
+def should_retry(retry_state):
+    # Só gasta uma ficha do orçamento quando outra tentativa vai de fato ocorrer.
+    if not retry_state.outcome.failed or retry_state.attempt_number >= RETRY_MAX_ATTEMPTS:
+        return False
+    return is_retryable_error(retry_state.outcome.exception()) and get_resilience_state().budget.try_spend()
+
+def resilient(host):
+    # Substitui as políticas fixas do tenacity: só repete erros transitórios,
+    # respeita Retry-After, usa um disjuntor por host e um orçamento global.
+    def decorator(func):
+        @tenacity.retry(retry=should_retry,
+                        wait=wait_retry_after_or_jitter,
+                        stop=tenacity.stop_after_attempt(RETRY_MAX_ATTEMPTS),
+                        reraise=True)
+        def attempt(*args, **kwargs):
+            breaker = get_resilience_state().breaker(host)
+            breaker.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                # 429 é limite da chave do usuário, não falha do host: não abre o
+                # disjuntor compartilhado e espera pelo Retry-After.
+                if is_retryable_error(e) and error_status_code(e) != 429:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            breaker.record_success()
+            return result
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Deposita no orçamento uma vez por chamada lógica, não por tentativa.
+            get_resilience_state().budget.record_call()
+            return attempt(*args, **kwargs)
+        return wrapper
+    return decorator
+
 ArxivParams = namedtuple(
     "ArxivParams",
-    ["query", "key_word", "page_num", "max_results", "days", "sort", "save_image", "file_format", "language"],
+    ["query", "key_word", "page_num", "max_results", "days", "sort", "save_image", "file_format", "language", "watch"],
+    defaults=(False,),
 )
 
+class ArxivSeenSet:
+    # Registro em disco dos artigos já processados para uma consulta:
+    # id do arXiv -> data de submissão da última versão vista.
+    # Limitação: a busca ordena pela primeira versão, então uma nova versão de
+    # um artigo anunciado bem antes da janela só é encontrada se page_num
+    # alcançar a página onde ele está.
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.entries = json.load(file)
+
+    @staticmethod
+    def arxiv_id(link):
+        return re.sub(r"v\d+$", "", link.rstrip('/').split('/')[-1])
+
+    def is_seen(self, link, date):
+        return self.entries.get(self.arxiv_id(link)) == date.isoformat()
+
+    def add(self, link, date):
+        self.entries[self.arxiv_id(link)] = date.isoformat()
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+def normalize_pdf_text(text):
+    return text.replace('-\n', '').replace('\n', ' ')
+
+class TextSpan:
+    # Um ou mais intervalos [início, fim) sobre o texto único de um PaperText.
+    # O texto só é copiado quando o consumidor pede str(span).
+    __slots__ = ('doc', 'bounds')
+
+    def __init__(self, doc, bounds=()):
+        self.doc = doc
+        self.bounds = array('L', bounds)
+
+    def ranges(self):
+        bounds = self.bounds
+        return [(bounds[i], bounds[i + 1]) for i in range(0, len(bounds), 2)]
+
+    def __len__(self):
+        return sum(end - start for start, end in self.ranges())
+
+    def __str__(self):
+        text = self.doc.text
+        return ''.join(text[start:end] for start, end in self.ranges())
+
+class PaperText:
+    # Texto normalizado do documento inteiro guardado uma única vez;
+    # as páginas são apenas deslocamentos dentro dele.
+    __slots__ = ('text', 'page_offsets')
+
+    def __init__(self, pages):
+        normalized_pages = [normalize_pdf_text(page) for page in pages]
+        self.page_offsets = array('L', [0])
+        total = 0
+        for page in normalized_pages:
+            total += len(page)
+            self.page_offsets.append(total)
+        self.text = ''.join(normalized_pages)
+
+    def __len__(self):
+        return len(self.page_offsets) - 1
+
+    def page_bounds(self, page_index):
+        return self.page_offsets[page_index], self.page_offsets[page_index + 1]
+
+    def page(self, page_index):
+        start, end = self.page_bounds(page_index)
+        return self.text[start:end]
+
+    def find_in_page(self, page_index, sub):
+        # Índice relativo à página, como str.find sobre o texto da página.
+        start, end = self.page_bounds(page_index)
+        index = self.text.find(sub, start, end)
+        return -1 if index == -1 else index - start
+
+    def span(self, *bounds):
+        return TextSpan(self, bounds)
+
+class SectionTextView(Mapping):
+    # Visão somente leitura nome -> texto; as seções são TextSpan e só viram
+    # str ao serem acessadas.
+    __slots__ = ('entries',)
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def span(self, key):
+        return self.entries[key]
+
+    def __getitem__(self, key):
+        value = self.entries[key]
+        return str(value) if isinstance(value, TextSpan) else value
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
 class Paper:
-    def __init__(self, path, title='', url='', abs='', authers=[]):
+    def __init__(self, path, title='', url='', abs='', authers=[], date=None):
         self.url = url
+        self.date = date
         self.path = path
         self.section_names = []
         self.section_texts = {}
         self.abs = abs
         self.title_page = 0
         self.title = title
-        self.pdf = fitz.open(self.path)
         self.parse_pdf()
         self.authers = authers
         self.roman_num = ["I", "II", 'III', "IV", "V", "VI", "VII", "VIII", "IIX", "IX", "X"]
@@ -57,22 +374,40 @@ class Paper:
 
     def parse_pdf(self):
         self.pdf = fitz.open(self.path)
-        self.text_list = [page.get_text() for page in self.pdf]
-        self.all_text = ' '.join(self.text_list)
-        self.section_page_dict = self._get_all_page_index()
-        self.section_text_dict = self._get_all_page()
-        self.section_text_dict.update({"title": self.title})
-        self.section_text_dict.update({"paper_info": self.get_paper_info()})
+        raw_pages = [page.get_text() for page in self.pdf]
+        self.section_page_dict = self._get_all_page_index(raw_pages)
+        self.paper_text = PaperText(raw_pages)
+        del raw_pages
+        section_spans = self._get_all_page()
+        section_spans.update({"title": self.title})
+        section_spans.update({"paper_info": self.get_paper_info(section_spans)})
+        self.section_text_dict = SectionTextView(section_spans)
         self.pdf.close()
 
-    def get_paper_info(self):
-        first_page_text = self.pdf[self.title_page].get_text()
-        if "Abstract" in self.section_text_dict.keys():
-            abstract_text = self.section_text_dict['Abstract']
+    # Texto das páginas já normalizado (sem '-\n' e com '\n' trocado por
+    # espaço); o texto bruto do PDF não é mais mantido.
+    @property
+    def text_list(self):
+        return [self.paper_text.page(i) for i in range(len(self.paper_text))]
+
+    @property
+    def all_text(self):
+        return ' '.join(self.text_list)
+
+    def get_paper_info(self, section_spans):
+        doc = self.paper_text
+        page_start, page_end = doc.page_bounds(self.title_page)
+        if "Abstract" in section_spans and len(section_spans["Abstract"].bounds) == 2:
+            abstract_start, abstract_end = section_spans["Abstract"].bounds
+        elif "Abstract" not in section_spans and self.abs:
+            abstract_start = doc.text.find(self.abs, page_start, page_end)
+            abstract_end = abstract_start + len(self.abs)
         else:
-            abstract_text = self.abs
-        first_page_text = first_page_text.replace(abstract_text, "")
-        return first_page_text
+            abstract_start = -1
+        if abstract_start == -1 or abstract_start == abstract_end \
+                or not page_start <= abstract_start < abstract_end <= page_end:
+            return doc.span(page_start, page_end)
+        return doc.span(page_start, abstract_start, abstract_end, page_end)
 
     def get_image_path(self, image_path=''):
         max_size = 0
@@ -166,7 +501,7 @@ class Paper:
         title = cur_title.replace('\n', ' ')
         return title
 
-    def _get_all_page_index(self):
+    def _get_all_page_index(self, raw_pages):
         section_list = ["Abstract",
                         'Introduction', 'Related Work', 'Background',
                         "Introduction and Motivation", "Computation Function", "Routing Function",
@@ -178,8 +513,7 @@ class Paper:
                         "Discussion", "Results and Discussion", "Conclusion",
                         'References']
         section_page_dict = {}
-        for page_index, page in enumerate(self.pdf):
-            cur_text = page.get_text()
+        for page_index, cur_text in enumerate(raw_pages):
             for section_name in section_list:
                 section_name_upper = section_name.upper()
                 if "Abstract" == section_name and section_name in cur_text:
@@ -191,52 +525,34 @@ class Paper:
                         section_page_dict[section_name] = page_index
         return section_page_dict
 
+    def _find_section(self, page_index, sec_name):
+        index = self.paper_text.find_in_page(page_index, sec_name)
+        if index == -1:
+            index = self.paper_text.find_in_page(page_index, sec_name.upper())
+        return index
+
     def _get_all_page(self):
-        text = ''
-        text_list = []
+        doc = self.paper_text
         section_dict = {}
-        text_list = [page.get_text() for page in self.pdf]
-        for sec_index, sec_name in enumerate(self.section_page_dict):
+        section_keys = list(self.section_page_dict.keys())
+        for sec_index, sec_name in enumerate(section_keys):
             if sec_index <= 0 and self.abs:
                 continue
+            start_page = self.section_page_dict[sec_name]
+            next_sec = section_keys[sec_index + 1] if sec_index < len(section_keys) - 1 else None
+            end_page = self.section_page_dict[next_sec] if next_sec else len(doc)
+            page_start, page_end = doc.page_bounds(start_page)
+            start_i = self._find_section(start_page, sec_name)
+            if start_page == end_page:
+                # Mesmo recorte que text[start_i:end_i] sobre a página.
+                end_i = self._find_section(start_page, next_sec)
+                start_i, end_i, _ = slice(start_i, end_i).indices(page_end - page_start)
+                section_dict[sec_name] = doc.span(page_start + start_i, page_start + max(start_i, end_i))
+            elif start_page < end_page:
+                start_i, _, _ = slice(start_i, None).indices(page_end - page_start)
+                section_dict[sec_name] = doc.span(page_start + start_i, doc.page_bounds(end_page - 1)[1])
             else:
-                start_page = self.section_page_dict[sec_name]
-                if sec_index < len(list(self.section_page_dict.keys())) - 1:
-                    end_page = self.section_page_dict[list(self.section_page_dict.keys())[sec_index + 1]]
-                else:
-                    end_page = len(text_list)
-                cur_sec_text = ''
-                if start_page == end_page:
-                    if sec_index < len(list(self.section_page_dict.keys())) - 1:
-                        next_sec = list(self.section_page_dict.keys())[sec_index + 1]
-                        if text_list[start_page].find(sec_name) == -1:
-                            start_i = text_list[start_page].find(sec_name.upper())
-                        else:
-                            start_i = text_list[start_page].find(sec_name)
-                        if text_list[start_page].find(next_sec) == -1:
-                            end_i = text_list[start_page].find(next_sec.upper())
-                        else:
-                            end_i = text_list[start_page].find(next_sec)
-                        cur_sec_text += text_list[start_page][start_i:end_i]
-                else:
-                    for page_i in range(start_page, end_page):
-                        if page_i == start_page:
-                            if text_list[start_page].find(sec_name) == -1:
-                                start_i = text_list[start_page].find(sec_name.upper())
-                            else:
-                                start_i = text_list[start_page].find(sec_name)
-                            cur_sec_text += text_list[page_i][start_i:]
-                        elif page_i < end_page:
-                            cur_sec_text += text_list[page_i]
-                        elif page_i == end_page:
-                            if sec_index < len(list(self.section_page_dict.keys())) - 1:
-                                next_sec = list(self.section_page_dict.keys())[sec_index + 1]
-                                if text_list[start_page].find(next_sec) == -1:
-                                    end_i = text_list[start_page].find(next_sec.upper())
-                                else:
-                                    end_i = text_list[start_page].find(next_sec)
-                                cur_sec_text += text_list[page_i][:end_i]
-                section_dict[sec_name] = cur_sec_text.replace('-\n', '').replace('\n', ' ')
+                section_dict[sec_name] = doc.span()
         return section_dict
 
 class Reader:
@@ -267,6 +583,10 @@ class Reader:
             self.gitee_key = ''
         self.max_token_num = 4096
         self.encoding = tiktoken.get_encoding("gpt2")
+        if args.watch:
+            self.seen_set = ArxivSeenSet(os.path.join(root_path, 'seen', self.validateTitle(query) + '.json'))
+        else:
+            self.seen_set = None
 
     def get_url(self, keyword, page):
         base_url = "https://arxiv.org/search/?"
@@ -281,12 +601,18 @@ class Reader:
             params["start"] = page * 50
         return base_url + requests.compat.urlencode(params)
 
+    @resilient(ARXIV_HOST)
+    def fetch_listing(self, url):
+        response = requests.get(url, timeout=ARXIV_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.text
+
     def get_titles(self, url, days=1):
         titles = []
         links = []
         dates = []
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, "html.parser")
+        seen_in_window = 0
+        soup = BeautifulSoup(self.fetch_listing(url), "html.parser")
         articles = soup.find_all("li", class_="arxiv-result")
         today = datetime.date.today()
         last_days = datetime.timedelta(days=days)
@@ -299,6 +625,9 @@ class Reader:
                 date_text = date_text.split('\n')[0].split("Submitted ")[-1].split("; ")[0]
                 date_text = datetime.datetime.strptime(date_text, "%d %B, %Y").date()
                 if today - date_text <= last_days:
+                    if self.seen_set is not None and self.seen_set.is_seen(link, date_text):
+                        seen_in_window += 1
+                        continue
                     titles.append(title.strip())
                     links.append(link)
                     dates.append(date_text)
@@ -308,20 +637,23 @@ class Reader:
                 exc_type, exc_obj, exc_tb = sys.exc_info()
                 fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
                 print(exc_type, fname, exc_tb.tb_lineno)
-        return titles, links, dates
+        return titles, links, dates, seen_in_window
 
     def get_all_titles_from_web(self, keyword, page_num=1, days=1):
         title_list, link_list, date_list = [], [], []
         for page in range(page_num):
             url = self.get_url(keyword, page)
-            titles, links, dates = self.get_titles(url, days)
-            if not titles:
-                break
+            titles, links, dates, seen_in_window = self.get_titles(url, days)
             for title_index, title in enumerate(titles):
                 print(page, title_index, title, links[title_index], dates[title_index])
             title_list.extend(titles)
             link_list.extend(links)
             date_list.extend(dates)
+            # A listagem é ordenada pela data da primeira versão, então uma página
+            # com artigos já vistos ainda pode ter novos ou atualizados depois
+            # dela; só paramos quando a página não tem nada dentro de `days`.
+            if not titles and not seen_in_window:
+                break
         print("-" * 40)
         return title_list, link_list, date_list
 
@@ -334,7 +666,7 @@ class Reader:
             print(title_index, title, links[title_index], dates[title_index])
             url = links[title_index] + ".pdf"
             filename = self.try_download_pdf(url, title)
-            paper = Paper(path=filename, url=links[title_index], title=title)
+            paper = Paper(path=filename, url=links[title_index], title=title, date=dates[title_index])
             paper_list.append(paper)
         return paper_list
 
@@ -344,7 +676,8 @@ class Reader:
         return new_title
 
     def download_pdf(self, url, title):
-        response = requests.get(url)
+        response = requests.get(url, timeout=ARXIV_REQUEST_TIMEOUT)
+        response.raise_for_status()
         date_str = str(datetime.datetime.now())[:13].replace(' ', '-')
         path = self.root_path + 'pdf_files/' + self.validateTitle(self.args.query) + '-' + date_str
         try:
@@ -356,9 +689,7 @@ class Reader:
             f.write(response.content)
         return filename
 
-    @tenacity.retry(wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-                    stop=tenacity.stop_after_attempt(5),
-                    reraise=True)
+    @resilient(ARXIV_HOST)
     def try_download_pdf(self, url, title):
         return self.download_pdf(url, title)
 
@@ -370,7 +701,7 @@ class Reader:
             text += 'Url:' + paper.url
             text += 'Abstract:' + paper.abs
             text += 'Paper_info:' + paper.section_text_dict['paper_info']
-            text += list(paper.section_text_dict.values())[0]
+            text += next(iter(paper.section_text_dict.values()))
             chat_summary_text = ""
             try:
                 chat_summary_text = self.chat_summary(text=text)
@@ -467,10 +798,10 @@ class Reader:
                                      date_str + '-' + self.validateTitle(self.query) + "." + self.file_format)
             self.export_to_markdown("\n".join(htmls), file_name=file_name, mode=mode)
             htmls = []
+            if self.seen_set is not None and chat_summary_text:
+                self.seen_set.add(paper.url, paper.date)
 
-    @tenacity.retry(wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-                    stop=tenacity.stop_after_attempt(5),
-                    reraise=True)
+    @resilient(OPENAI_HOST)
     def chat_conclusion(self, text, conclusion_prompt_token=800):
         openai.api_key = self.chat_api_list[self.cur_api]
         self.cur_api += 1
@@ -511,9 +842,7 @@ class Reader:
         print("response_time:", response.response_ms / 1000.0, 's')
         return result
 
-    @tenacity.retry(wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-                    stop=tenacity.stop_after_attempt(5),
-                    reraise=True)
+    @resilient(OPENAI_HOST)
     def chat_method(self, text, method_prompt_token=800):
         openai.api_key = self.chat_api_list[self.cur_api]
         self.cur_api += 1
@@ -556,9 +885,7 @@ class Reader:
         print("response_time:", response.response_ms / 1000.0, 's')
         return result
 
-    @tenacity.retry(wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-                    stop=tenacity.stop_after_attempt(5),
-                    reraise=True)
+    @resilient(OPENAI_HOST)
     def chat_summary(self, text, summary_prompt_token=1100):
         openai.api_key = self.chat_api_list[self.cur_api]
         self.cur_api += 1
@@ -625,7 +952,7 @@ def chat_arxiv_main(args):
 
 # Funções auxiliares
 def load_agent_options() -> list:
-    agent_options = ['Escolher um especialista...']
+    agent_options = [NEW_EXPERT_OPTION]
     if os.path.exists(FILEPATH):
         with open(FILEPATH, 'r') as file:
             try:
@@ -641,19 +968,217 @@ def get_max_tokens(model_name: str) -> int:
 def refresh_page():
     st.rerun()
 
-def save_expert(expert_title: str, expert_description: str):
-    with open(FILEPATH, 'r+') as file:
-        agents = json.load(file) if os.path.getsize(FILEPATH) > 0 else []
-        agents.append({"agente": expert_title, "descricao": expert_description})
-        file.seek(0)
-        json.dump(agents, file, indent=4)
-        file.truncate()
+def save_expert(expert_title: str, expert_description: str, request_text: str = ""):
+    with AGENTS_FILE_LOCK:
+        agents = []
+        if os.path.exists(FILEPATH) and os.path.getsize(FILEPATH) > 0:
+            with open(FILEPATH, 'r') as file:
+                agents = json.load(file)
+        if any(agent.get("agente") == expert_title for agent in agents):
+            return
+        agent = {"agente": expert_title, "descricao": expert_description}
+        if request_text:
+            agent["solicitacao"] = request_text
+        agents.append(agent)
+        # Grava em arquivo temporário e troca de uma vez, para que leitores
+        # concorrentes nunca vejam o JSON pela metade.
+        tmp_path = FILEPATH + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(agents, file, indent=4)
+        os.replace(tmp_path, FILEPATH)
+
+def tokenize_expert_text(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    tokens = [token for token in re.findall(r"\w+", text) if len(token) > 2 and token not in EXPERT_STOPWORDS]
+    # Plural simples: "bacias" e "bacia" contam como a mesma palavra.
+    return [token[:-1] if len(token) > 4 and token.endswith("s") else token for token in tokens]
+
+def expert_index_text(agent: dict) -> str:
+    description = agent.get("descricao", "")
+    if isinstance(description, dict):
+        description = " ".join(str(value) for value in description.values())
+    return " ".join([agent.get("agente", "").replace("_", " "), str(description)])
+
+class ExpertIndex:
+    # Índice TF-IDF local sobre as descrições dos especialistas salvos, usado
+    # para reaproveitar um especialista parecido antes de chamar a fase um.
+    def __init__(self, agents: list):
+        self.agents = [agent for agent in agents if "agente" in agent]
+        term_counts = []
+        document_frequency = {}
+        for agent in self.agents:
+            counts = {}
+            for token in tokenize_expert_text(expert_index_text(agent)):
+                counts[token] = counts.get(token, 0) + 1
+            term_counts.append(counts)
+            for token in counts:
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        total = len(self.agents)
+        self.idf = {token: math.log((1 + total) / (1 + df)) + 1 for token, df in document_frequency.items()}
+        # Palavras fora do índice recebem o maior IDF possível (df = 0).
+        self.unknown_idf = math.log(1 + total) + 1
+        self.postings = {}
+        for agent_index, counts in enumerate(term_counts):
+            weights = {token: count * self.idf[token] for token, count in counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            for token, weight in weights.items():
+                self.postings.setdefault(token, []).append((agent_index, weight / norm))
+
+    def best_match(self, text: str) -> Tuple[Optional[dict], float]:
+        counts = {}
+        for token in tokenize_expert_text(text):
+            counts[token] = counts.get(token, 0) + 1
+        # As palavras desconhecidas entram na norma da consulta, senão um pedido
+        # longo que só compartilha uma ou duas palavras parece muito similar.
+        query = {token: count * self.idf.get(token, self.unknown_idf) for token, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in query.values()))
+        scores = {}
+        for token, weight in query.items():
+            for agent_index, agent_weight in self.postings.get(token, ()):
+                scores[agent_index] = scores.get(agent_index, 0.0) + weight / norm * agent_weight
+        if not scores:
+            return None, 0.0
+        agent_index, score = max(scores.items(), key=lambda item: item[1])
+        return self.agents[agent_index], score
+
+@st.cache_resource(max_entries=1)
+def load_expert_index(modified_time: float) -> ExpertIndex:
+    with open(FILEPATH, 'r') as file:
+        return ExpertIndex(json.load(file) if os.path.getsize(FILEPATH) > 0 else [])
 
-def fetch_assistant_response(user_input: str, user_prompt: str, model_name: str, temperature: float, agent_selection: str, groq_api_key: str) -> Tuple[str, str]:
+def find_similar_expert(request_text: str) -> Optional[dict]:
+    if not os.path.exists(FILEPATH):
+        return None
+    agent, score = load_expert_index(os.path.getmtime(FILEPATH)).best_match(request_text)
+    return agent if score >= EXPERT_SIMILARITY_THRESHOLD else None
+
+class ModelLatencyStats:
+    # Latência média móvel (EWMA) de cada modelo, compartilhada entre sessões.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.calls = {}
+        self.failures = {}
+
+    def record(self, model_name: str, seconds: float, failed: bool = False):
+        with self.lock:
+            if failed:
+                self.failures[model_name] = self.failures.get(model_name, 0) + 1
+                seconds = max(seconds, LATENCY_FAILURE_PENALTY)
+            self.calls[model_name] = self.calls.get(model_name, 0) + 1
+            previous = self.latency.get(model_name)
+            if previous is None:
+                self.latency[model_name] = seconds
+            else:
+                self.latency[model_name] = LATENCY_EWMA_ALPHA * seconds + (1 - LATENCY_EWMA_ALPHA) * previous
+
+    def record_lower_bound(self, model_name: str, seconds: float):
+        # Modelo cancelado na corrida: só se sabe que levaria mais que o
+        # vencedor, então entra com uma margem para ficar atrás dele.
+        with self.lock:
+            self.calls[model_name] = self.calls.get(model_name, 0) + 1
+            self.latency[model_name] = max(self.latency.get(model_name, 0.0), seconds * LATENCY_LOSER_MARGIN)
+
+    def default_models(self, count: int) -> List[str]:
+        with self.lock:
+            measured = sorted((name for name in MODEL_MAX_TOKENS if name in self.latency), key=self.latency.get)
+            unmeasured = [name for name in MODEL_MAX_TOKENS if name not in self.latency]
+        # Regra de exploração: quando há mais de uma vaga, a última fica com um
+        # modelo ainda não medido; as demais seguem a menor latência observada.
+        chosen = measured[:count - 1] + unmeasured[:1] if count > 1 and measured else []
+        ranked = chosen + [name for name in measured + unmeasured if name not in chosen]
+        return ranked[:count]
+
+@st.cache_resource
+def get_model_latency_stats() -> ModelLatencyStats:
+    return ModelLatencyStats()
+
+def pick_default_models(count: int = 1) -> List[str]:
+    return get_model_latency_stats().default_models(count)
+
+@resilient(GROQ_HOST)
+def stream_completion(client: Groq, prompt: str, model_name: str, temperature: float, cancel_event: threading.Event, partials: Dict[str, str]) -> str:
+    # Uma nova tentativa após o fim da corrida não faz outra requisição.
+    if cancel_event.is_set():
+        return partials.get(model_name, "")
+    partials[model_name] = ""
+    stream = client.chat.completions.create(
+        messages=[
+            {"role": "system", "content": "Você é um assistente útil."},
+            {"role": "user", "content": prompt},
+        ],
+        model=model_name,
+        temperature=temperature,
+        max_tokens=get_max_tokens(model_name),
+        top_p=1,
+        stop=None,
+        stream=True
+    )
+    try:
+        for chunk in stream:
+            if cancel_event.is_set():
+                break
+            partials[model_name] += chunk.choices[0].delta.content or ""
+    finally:
+        stream.response.close()
+    return partials.get(model_name, "")
+
+def run_model_fan_out(client: Groq, prompt: str, model_names: List[str], temperature: float, wait_for_all: bool = False, on_update: Optional[Callable[[Dict[str, str], Optional[str]], None]] = None) -> Tuple[str, Dict[str, str]]:
+    # Envia o mesmo prompt a vários modelos. Na corrida, a primeira resposta
+    # não vazia vence e as demais são canceladas; com wait_for_all, todas são
+    # transmitidas lado a lado até o fim.
+    stats = get_model_latency_stats()
+    cancel_event = threading.Event()
+    partials = {}
+    results = {}
+    winner = None
+    last_error = None
+    executor = ThreadPoolExecutor(max_workers=len(model_names))
+    started = time.monotonic()
+    pending = {executor.submit(stream_completion, client, prompt, name, temperature, cancel_event, partials): name
+               for name in model_names}
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                elapsed = time.monotonic() - started
+                try:
+                    text = future.result()
+                except Exception as e:
+                    last_error = e
+                    stats.record(name, elapsed, failed=True)
+                    continue
+                stats.record(name, elapsed)
+                if text.strip():
+                    results[name] = text
+                    if winner is None:
+                        winner = name
+                        if not wait_for_all:
+                            cancel_event.set()
+            if on_update:
+                on_update(dict(partials), winner)
+            if winner and not wait_for_all:
+                break
+    finally:
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        elapsed = time.monotonic() - started
+        for name in pending.values():
+            stats.record_lower_bound(name, elapsed)
+    if winner is None:
+        if last_error:
+            raise last_error
+        raise ValueError("Nenhum modelo retornou uma resposta válida.")
+    return winner, results
+
+def fetch_assistant_response(user_input: str, user_prompt: str, model_name: str, temperature: float, agent_selection: str, groq_api_key: str, response_mode: str = "single", race_models: Optional[List[str]] = None, on_update: Optional[Callable[[Dict[str, str], Optional[str]], None]] = None, raise_errors: bool = False) -> Tuple[str, str]:
     phase_two_response = ""
     expert_title = ""
     try:
-        client = Groq(api_key=groq_api_key)
+        client = Groq(api_key=groq_api_key, max_retries=0)
+        @resilient(GROQ_HOST)
         def get_completion(prompt: str) -> str:
             completion = client.chat.completions.create(
                 messages=[
@@ -668,17 +1193,23 @@ def fetch_assistant_response(user_input: str, user_prompt: str, model_name: str,
                 stream=False
             )
             return completion.choices[0].message.content
-        if agent_selection == "Escolha um especialista...":
+        request_text = f"{user_input} {user_prompt}".strip()
+        similar_expert = find_similar_expert(request_text) if agent_selection == NEW_EXPERT_OPTION else None
+        if similar_expert:
+            # Reaproveita um especialista parecido e evita a chamada da fase um.
+            expert_title = similar_expert["agente"]
+            expert_description = similar_expert["descricao"]
+        elif agent_selection == NEW_EXPERT_OPTION:
             phase_one_prompt = (
-                "Você é um assistente de pesquisa de alta precisão e profundidade."
-                "Determine o especialista mais adequado para responder à solicitação: {user_input} e {user_prompt}."
-                "Forneça um título e uma descrição detalhada das habilidades do especialista."
+                f"Você é um assistente de pesquisa de alta precisão e profundidade."
+                f"Determine o especialista mais adequado para responder à solicitação: {user_input} e {user_prompt}."
+                f"Forneça um título e uma descrição detalhada das habilidades do especialista."
             )
             phase_one_response = get_completion(phase_one_prompt)
             first_period_index = phase_one_response.find(".")
             expert_title = phase_one_response[:first_period_index].strip()
             expert_description = phase_one_response[first_period_index + 1:].strip()
-            save_expert(expert_title, expert_description)
+            save_expert(expert_title, expert_description, request_text)
         else:
             with open(FILEPATH, 'r') as file:
                 agents = json.load(file)
@@ -692,15 +1223,29 @@ def fetch_assistant_response(user_input: str, user_prompt: str, model_name: str,
             f"Você é {expert_title}, um especialista renomado. Forneça uma resposta detalhada e abrangente para a solicitação: {user_input} e {user_prompt}."
             f"Use sua experiência para abordar todos os aspectos relevantes da questão."
         )
-        phase_two_response = get_completion(phase_two_prompt)
+        if response_mode != "single" and race_models:
+            _, results = run_model_fan_out(client, phase_two_prompt, race_models, temperature,
+                                           wait_for_all=response_mode == "side_by_side", on_update=on_update)
+            phase_two_response = next(iter(results.values()))
+        else:
+            started = time.monotonic()
+            try:
+                phase_two_response = get_completion(phase_two_prompt)
+            except Exception:
+                get_model_latency_stats().record(model_name, time.monotonic() - started, failed=True)
+                raise
+            get_model_latency_stats().record(model_name, time.monotonic() - started)
     except Exception as e:
+        if raise_errors:
+            raise
         st.error(f"Ocorreu um erro: {e}")
         return "", ""
     return expert_title, phase_two_response
 
-def refine_response(expert_title: str, phase_two_response: str, user_input: str, user_prompt: str, model_name: str, temperature: float, groq_api_key: str, references_file: str) -> str:
+def refine_response(expert_title: str, phase_two_response: str, user_input: str, user_prompt: str, model_name: str, temperature: float, groq_api_key: str, references_file: str, raise_errors: bool = False) -> str:
     try:
-        client = Groq(api_key=groq_api_key)
+        client = Groq(api_key=groq_api_key, max_retries=0)
+        @resilient(GROQ_HOST)
         def get_completion(prompt: str) -> str:
             completion = client.chat.completions.create(
                 messages=[
@@ -727,12 +1272,15 @@ def refine_response(expert_title: str, phase_two_response: str, user_input: str,
         refined_response = get_completion(refine_prompt)
         return refined_response
     except Exception as e:
+        if raise_errors:
+            raise
         st.error(f"Ocorreu um erro durante o refinamento: {e}")
         return ""
 
-def evaluate_response_with_rag(user_input: str, user_prompt: str, expert_description: str, assistant_response: str, model_name: str, temperature: float, groq_api_key: str) -> str:
+def evaluate_response_with_rag(user_input: str, user_prompt: str, expert_description: str, assistant_response: str, model_name: str, temperature: float, groq_api_key: str, raise_errors: bool = False) -> str:
     try:
-        client = Groq(api_key=groq_api_key)
+        client = Groq(api_key=groq_api_key, max_retries=0)
+        @resilient(GROQ_HOST)
         def get_completion(prompt: str) -> str:
             completion = client.chat.completions.create(
                 messages=[
@@ -755,9 +1303,187 @@ def evaluate_response_with_rag(user_input: str, user_prompt: str, expert_descrip
         rag_response = get_completion(rag_prompt)
         return rag_response
     except Exception as e:
+        if raise_errors:
+            raise
         st.error(f"Ocorreu um erro durante a avaliação com RAG: {e}")
         return ""
 
+# Execução em lote (sem interface)
+def process_batch_row(row: dict, default_model: str, temperature: float, groq_api_key: str) -> dict:
+    # As saídas de cada etapa ficam na linha; numa nova tentativa, as etapas
+    # já concluídas não são refeitas.
+    user_input = row.get("user_input", "")
+    user_prompt = row.get("user_prompt", "")
+    model_name = row.get("model") or default_model
+    agent_selection = row.get("agent") or NEW_EXPERT_OPTION
+    result = dict(row, model=model_name)
+    try:
+        if not result.get("response"):
+            result["expert_title"], result["response"] = fetch_assistant_response(
+                user_input, user_prompt, model_name, temperature, agent_selection, groq_api_key, raise_errors=True)
+            if not result["response"]:
+                raise ValueError("O modelo retornou uma resposta vazia.")
+        if not result.get("refined_response"):
+            result["refined_response"] = refine_response(result["expert_title"], result["response"], user_input, user_prompt,
+                                                         model_name, temperature, groq_api_key, None, raise_errors=True)
+        if not result.get("rag_response"):
+            result["rag_response"] = evaluate_response_with_rag(user_input, user_prompt, result["expert_title"], result["response"],
+                                                                model_name, temperature, groq_api_key, raise_errors=True)
+    except Exception as e:
+        # "circuit_open" e "retry" são estados internos: a linha volta para a fila.
+        if isinstance(e, CircuitOpenError):
+            status = "circuit_open"
+        elif is_retryable_error(e):
+            status = "retry"
+        else:
+            status = "error"
+        result.update(status=status, error=f"{type(e).__name__}: {e}")
+        return result
+    completed = bool(result["refined_response"] and result["rag_response"])
+    result.update(status="ok" if completed else "error",
+                  error="" if completed else "O modelo retornou uma resposta vazia.")
+    return result
+
+def read_completed_batch_ids(output_path: str) -> set:
+    # A própria saída serve de checkpoint: linhas com status "ok" não são refeitas.
+    completed_ids = set()
+    if os.path.exists(output_path):
+        with open(output_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(result, dict) and result.get("status") == "ok":
+                    completed_ids.add(str(result["id"]))
+    return completed_ids
+
+def iter_batch_rows(input_path: str, completed_ids: set):
+    # Gera (linha, erro); linhas malformadas vêm com o erro preenchido em vez
+    # de interromper o lote.
+    with open(input_path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("a linha não é um objeto JSON")
+            except ValueError as e:
+                yield {"id": str(line_number)}, f"{type(e).__name__}: {e}"
+                continue
+            row["id"] = str(row.get("id", line_number))
+            if row["id"] not in completed_ids:
+                yield row, None
+
+def run_batch(input_path: str, output_path: str, concurrency: int, default_model: str, temperature: float, groq_api_key: str) -> int:
+    completed_ids = read_completed_batch_ids(output_path)
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            needs_newline = file.read(1) != b"\n"
+    else:
+        needs_newline = False
+    processed = failed = 0
+    breaker = get_resilience_state().breaker(GROQ_HOST)
+    rows = iter_batch_rows(input_path, completed_ids)
+    # Fila de reenvio ordenada por (pronta_em, seq, linha).
+    requeued_rows = []
+    requeue_sequence = itertools.count()
+    requeue_counts = {}
+    pending = {}
+    with open(output_path, 'a', encoding='utf-8') as output, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if needs_newline:
+            output.write("\n")
+
+        def write_result(result):
+            nonlocal processed, failed
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            processed += 1
+            failed += result["status"] != "ok"
+
+        def requeue(row, delay):
+            heapq.heappush(requeued_rows, (time.monotonic() + delay, next(requeue_sequence), row))
+
+        def write_results(futures):
+            for future in futures:
+                pending.pop(future)
+                result = future.result()
+                row = {key: value for key, value in result.items() if key not in ("status", "error")}
+                if result["status"] == "circuit_open":
+                    # Não chegou a chamar a API; volta para a fila sem contar tentativa.
+                    requeue(row, 0.0)
+                    continue
+                if result["status"] == "retry":
+                    # Reenviar é uma nova tentativa: gasta do mesmo orçamento global
+                    # e espera um backoff crescente antes de voltar.
+                    count = requeue_counts[row["id"]] = requeue_counts.get(row["id"], 0) + 1
+                    if count <= BATCH_MAX_REQUEUES and get_resilience_state().budget.try_spend():
+                        requeue(row, random.uniform(0, min(BATCH_REQUEUE_MAX_DELAY, RETRY_MAX_DELAY * 2 ** (count - 1))))
+                        continue
+                    result.update(status="error", error=result["error"] + " (novas tentativas esgotadas)")
+                write_result(result)
+            output.flush()
+            print(f"Processadas: {processed} | Falhas: {failed} | Na fila: {len(requeued_rows)}")
+
+        try:
+            while True:
+                # Enquanto o disjuntor da Groq está aberto, nada novo é enviado;
+                # mantém no máximo 2 x concurrency linhas em andamento.
+                pause = breaker.retry_in()
+                if pause or len(pending) >= concurrency * 2:
+                    if pending:
+                        done, _ = wait(pending, timeout=pause or None, return_when=FIRST_COMPLETED)
+                        write_results(done)
+                    else:
+                        time.sleep(pause)
+                    continue
+                now = time.monotonic()
+                if requeued_rows and requeued_rows[0][0] <= now:
+                    row, error = heapq.heappop(requeued_rows)[2], None
+                else:
+                    row, error = next(rows, (None, None))
+                if row is None:
+                    if not pending and not requeued_rows:
+                        break
+                    timeout = max(0.0, requeued_rows[0][0] - now) if requeued_rows else None
+                    if pending:
+                        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                        write_results(done)
+                    else:
+                        time.sleep(timeout)
+                    continue
+                if error:
+                    write_result(dict(row, status="error", error=error))
+                    continue
+                pending[executor.submit(process_batch_row, row, default_model, temperature, groq_api_key)] = row
+        finally:
+            # Resultados já concluídos nunca se perdem; linhas ainda na fila
+            # ficam para a próxima execução pelo checkpoint.
+            write_results(list(pending))
+    return 1 if failed else 0
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("deve ser um inteiro maior ou igual a 1")
+    return number
+
+def batch_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="run.py", description="Executa o fluxo resposta -> refinamento -> RAG para um arquivo JSONL.")
+    parser.add_argument("--batch", nargs=2, metavar=("ENTRADA", "SAIDA"), required=True,
+                        help="JSONL com user_input, user_prompt, agent e model; JSONL de saída (também usado como checkpoint)")
+    parser.add_argument("--concurrency", type=positive_int, default=BATCH_DEFAULT_CONCURRENCY)
+    parser.add_argument("--model", default=list(MODEL_MAX_TOKENS.keys())[0], choices=list(MODEL_MAX_TOKENS.keys()))
+    parser.add_argument("--temperature", type=float, default=0.5)
+    parser.add_argument("--groq-api-key", default=os.environ.get("GROQ_API_KEY", ""))
+    args = parser.parse_args(argv)
+    input_path, output_path = args.batch
+    return run_batch(input_path, output_path, args.concurrency, args.model, args.temperature, args.groq_api_key)
+
+if "--batch" in sys.argv:
+    sys.exit(batch_main(sys.argv[1:]))
+
 # Carregar as opções de especialistas do arquivo JSON
 agent_options = load_agent_options()
 
@@ -767,12 +1493,34 @@ st.title("Consulta ao arXiv com Resumo e Avaliação de Especialistas")
 user_input = st.text_area("Digite sua solicitação:")
 user_prompt = st.text_area("Digite o prompt adicional (opcional):")
 agent_selection = st.selectbox("Escolha um Especialista", options=agent_options)
-model_name = st.selectbox("Escolha um Modelo", list(MODEL_MAX_TOKENS.keys()))
+model_list = list(MODEL_MAX_TOKENS.keys())
+# Os padrões adaptativos são calculados uma vez por sessão para não trocar a
+# escolha do usuário entre "Buscar" e "Refinar".
+if "model_name" not in st.session_state:
+    st.session_state.model_name = pick_default_models(1)[0]
+model_name = st.selectbox("Escolha um Modelo", model_list, key="model_name")
+response_mode = RESPONSE_MODES[st.selectbox("Modo de Resposta", list(RESPONSE_MODES.keys()))]
+race_models = []
+if response_mode != "single":
+    if "race_models" not in st.session_state:
+        st.session_state.race_models = pick_default_models(2)
+    race_models = st.multiselect("Modelos em paralelo", model_list, key="race_models")
 temperature = st.slider("Nível de Criatividade", 0.0, 1.0, 0.5)
 groq_api_key = st.text_input("Chave da API Groq")
 
 if st.button("Buscar Resposta"):
-    expert_title, response = fetch_assistant_response(user_input, user_prompt, model_name, temperature, agent_selection, groq_api_key)
+    on_update = None
+    if response_mode != "single" and race_models:
+        model_columns = dict(zip(race_models, st.columns(len(race_models))))
+        model_placeholders = {name: column.empty() for name, column in model_columns.items()}
+
+        def render_partials(partials, winner):
+            for name, placeholder in model_placeholders.items():
+                label = f"**{name}** (vencedor)" if name == winner else f"**{name}**"
+                placeholder.markdown(f"{label}\n\n{partials.get(name, '')}")
+        on_update = render_partials
+    expert_title, response = fetch_assistant_response(user_input, user_prompt, model_name, temperature, agent_selection, groq_api_key,
+                                                      response_mode=response_mode, race_models=race_models, on_update=on_update)
     st.session_state.expert_title = expert_title
     st.session_state.response = response
     st.write(f"Especialista: {expert_title}")